@@ -1,11 +1,18 @@
 import os
+import time
+import threading
+import hashlib
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from jose import JWTError, ExpiredSignatureError, jwt
+from jose.backends.cryptography_backend import CryptographyHMACKey
+from jose.utils import base64url_decode
 import bcrypt
+import orjson
+from cachetools import TTLCache
 
 from database import get_db
 from sqlalchemy.orm import Session
@@ -15,14 +22,30 @@ from models import ConfigStorage
 SECRET_KEY = os.getenv("SECRET_KEY", "b3c5a6d7e8f90123456789abcdef0123456789abcdef0123456789abcdef0123")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+# bcrypt work factor, tune per host towards ~250ms per hash
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "10"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login")
 
+# Built once, jwt.decode would re-wrap SECRET_KEY on every call
+_HMAC_KEY = CryptographyHMACKey(SECRET_KEY, ALGORITHM)
+
+# Decoded tokens, keyed by a digest of the raw token -> (username, exp).
+# Only tokens that passed full validation are stored here.
+_token_cache = TTLCache(maxsize=1024, ttl=60)
+# get_current_user runs in the threadpool and TTLCache is not thread-safe
+_token_cache_lock = threading.Lock()
+
+def invalidate_token_cache():
+    # Must be called whenever the admin credentials change
+    with _token_cache_lock:
+        _token_cache.clear()
+
 def get_password_hash(password: str) -> str:
     # bcrypt requires bytes, so we encode
     pwd_bytes = password.encode('utf-8')
     # Generate a salt and hash the password
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_COST)
     hashed = bcrypt.hashpw(pwd_bytes, salt)
     return hashed.decode('utf-8')
 
@@ -35,9 +58,9 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     except ValueError:
         return False
 
-# Hardcoded fallback admin credentials for first boot
+# Hardcoded fallback admin username for first boot.
+# The default password is only hashed by /api/login when no DB row exists yet.
 ADMIN_USERNAME_FALLBACK = os.getenv("ADMIN_USERNAME", "admin")
-ADMIN_PASSWORD_HASH = get_password_hash(os.getenv("ADMIN_PASSWORD", "admin123"))
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -49,14 +72,45 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_access_token(token: str) -> dict:
+    """Verify and decode one of our own HS256 tokens, raises JWTError when invalid"""
+    try:
+        header_b64, payload_b64, signature_b64 = token.encode('ascii').split(b'.')
+        header = orjson.loads(base64url_decode(header_b64))
+        if not isinstance(header, dict) or header.get("alg") != ALGORITHM:
+            raise JWTError("The specified alg value is not allowed")
+        if not _HMAC_KEY.verify(header_b64 + b'.' + payload_b64, base64url_decode(signature_b64)):
+            raise JWTError("Signature verification failed.")
+        payload = orjson.loads(base64url_decode(payload_b64))
+    except (ValueError, TypeError):
+        # Wrong segment count, bad base64 or bad JSON
+        raise JWTError("Invalid token")
+        
+    if not isinstance(payload, dict) or not isinstance(payload.get("exp"), (int, float)):
+        raise JWTError("Invalid token claims")
+    if payload["exp"] <= time.time():
+        raise ExpiredSignatureError("Signature has expired.")
+    return payload
+
+# Plain def: FastAPI runs it in the threadpool, so the JWT decode and the
+# admin_username query on a cache miss never block the event loop
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> str:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cache_key = hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+    with _token_cache_lock:
+        cached = _token_cache.get(cache_key)
+        if cached:
+            username, exp = cached
+            if exp > time.time():
+                return username
+            _token_cache.pop(cache_key, None)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -69,4 +123,6 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     if username != expected_username:
         raise credentials_exception
         
+    with _token_cache_lock:
+        _token_cache[cache_key] = (username, payload["exp"])
     return username
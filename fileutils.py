@@ -0,0 +1,26 @@
+import os
+
+# Read size when walking a log file backwards from EOF
+TAIL_BLOCK_SIZE = 65536
+
+def tail(path, n):
+    """Return the last n lines of a file as bytes, reading backwards from EOF in blocks"""
+    if n <= 0:
+        return []
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        pos = os.fstat(fd).st_size
+        # Collected newest first and joined once, prepending would copy everything read so far
+        blocks = []
+        newlines = 0
+        # One extra newline so the first kept line is complete
+        while pos > 0 and newlines <= n:
+            read_size = min(TAIL_BLOCK_SIZE, pos)
+            pos -= read_size
+            # pread takes the offset directly, no seek per block
+            block = os.pread(fd, read_size, pos)
+            newlines += block.count(b'\n')
+            blocks.append(block)
+    finally:
+        os.close(fd)
+    return b"".join(reversed(blocks)).splitlines()[-n:]
@@ -4,10 +4,11 @@ from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordRequestForm
 from auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
-from datetime import timedelta
+from datetime import datetime, timedelta
 from database import engine, get_db
 import models
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
 from fastapi.middleware.gzip import GZipMiddleware
 import tasks
 
@@ -22,11 +23,17 @@ scheduler = BackgroundScheduler()
 async def lifespan(app: FastAPI):
     # Startup
     models.Base.metadata.create_all(bind=engine)
-    scheduler.add_job(tasks.collect_system_metrics, 'interval', seconds=3)
+    tasks.load_recent_metrics()
+    # CPU sampling gets its own single-thread executor, psutil tracks cpu_percent per thread
+    scheduler.add_executor(ThreadPoolExecutor(max_workers=1), 'cpu_sampler')
+    scheduler.add_job(tasks.sample_cpu_percent, 'interval', seconds=1, executor='cpu_sampler')
+    scheduler.add_job(tasks.collect_system_metrics, 'interval', seconds=tasks.COLLECT_INTERVAL_SECONDS)
+    scheduler.add_job(tasks.purge_old_metrics, 'interval', hours=tasks.METRICS_PURGE_INTERVAL_HOURS, next_run_time=datetime.now())
     scheduler.start()
     yield
     # Shutdown
     scheduler.shutdown()
+    tasks.flush_metrics_buffer()
 
 app = FastAPI(title="Linux Server Monitor", lifespan=lifespan)
 app.add_middleware(GZipMiddleware, minimum_size=500)
@@ -47,13 +54,35 @@ class PasswordChangeRequest(BaseModel):
     new_username: str
     new_password: str
 
+def _load_admin_config(db: Session):
+    # Fetch all admin credential rows in a single roundtrip, keyed by config key
+    from models import ConfigStorage
+    rows = db.query(ConfigStorage).filter(
+        ConfigStorage.key.in_(("admin_username", "admin_password", "admin_password_is_default"))
+    ).all()
+    return {r.key: r for r in rows}
+
+def _set_default_password_flag(db: Session, admin_config: dict, is_default: bool):
+    # Cheap stand-in for bcrypt-checking "admin123" on every login/verify
+    from models import ConfigStorage
+    value = "1" if is_default else "0"
+    default_row = admin_config.get("admin_password_is_default")
+    if not default_row:
+        default_row = ConfigStorage(key="admin_password_is_default", value=value)
+        db.add(default_row)
+        admin_config["admin_password_is_default"] = default_row
+    else:
+        default_row.value = value
+
 @app.post("/api/login")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     from auth import ADMIN_USERNAME_FALLBACK, verify_password, get_password_hash
     from models import ConfigStorage
     
+    admin_config = _load_admin_config(db)
+    
     # Init or fetch username
-    config_user = db.query(ConfigStorage).filter(ConfigStorage.key == "admin_username").first()
+    config_user = admin_config.get("admin_username")
     if not config_user:
         config_user = ConfigStorage(key="admin_username", value=ADMIN_USERNAME_FALLBACK)
         db.add(config_user)
@@ -67,7 +96,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
         
-    config = db.query(ConfigStorage).filter(ConfigStorage.key == "admin_password").first()
+    config = admin_config.get("admin_password")
     if not config:
         config = ConfigStorage(key="admin_password", value=get_password_hash("admin123"))
         db.add(config)
@@ -85,23 +114,32 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     access_token = create_access_token(
         data={"sub": config_user.value}, expires_delta=access_token_expires
     )
-    is_default = verify_password("admin123", config.value) and config_user.value == "admin"
+    default_row = admin_config.get("admin_password_is_default")
+    if not default_row:
+        # First run or pre-flag database: the submitted password was just verified
+        _set_default_password_flag(db, admin_config, form_data.password == "admin123")
+        db.commit()
+        default_row = admin_config["admin_password_is_default"]
+    is_default = default_row.value == "1" and config_user.value == "admin"
     return {"access_token": access_token, "token_type": "bearer", "is_default_password": is_default, "username": config_user.value}
 
 @app.post("/api/user/password")
 async def change_password(data: PasswordChangeRequest, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
-    from auth import verify_password, get_password_hash
+    from auth import verify_password, get_password_hash, invalidate_token_cache
     from models import ConfigStorage
     
-    config = db.query(ConfigStorage).filter(ConfigStorage.key == "admin_password").first()
+    admin_config = _load_admin_config(db)
+    
+    config = admin_config.get("admin_password")
     if not config or not verify_password(data.old_password, config.value):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="原登录密码效验失败，验证无效")
         
     # Update password
     config.value = get_password_hash(data.new_password)
+    _set_default_password_flag(db, admin_config, data.new_password == "admin123")
     
     # Update username
-    config_user = db.query(ConfigStorage).filter(ConfigStorage.key == "admin_username").first()
+    config_user = admin_config.get("admin_username")
     if not config_user:
         config_user = ConfigStorage(key="admin_username", value=data.new_username)
         db.add(config_user)
@@ -109,18 +147,26 @@ async def change_password(data: PasswordChangeRequest, db: Session = Depends(get
         config_user.value = data.new_username
         
     db.commit()
+    invalidate_token_cache()
     return {"status": "success", "message": "账户口令修改成功，请使用新身份重新登录"}
 
 @app.get("/api/verify_token")
 async def verify_token(current_user: str = Depends(get_current_user), db: Session = Depends(get_db)):
     from auth import verify_password
-    from models import ConfigStorage
     
-    config = db.query(ConfigStorage).filter(ConfigStorage.key == "admin_password").first()
-    config_user = db.query(ConfigStorage).filter(ConfigStorage.key == "admin_username").first()
+    admin_config = _load_admin_config(db)
+    config = admin_config.get("admin_password")
+    config_user = admin_config.get("admin_username")
+    
+    default_row = admin_config.get("admin_password_is_default")
+    if config and not default_row:
+        # Pre-flag database, check the hash once and remember the result
+        _set_default_password_flag(db, admin_config, verify_password("admin123", config.value))
+        db.commit()
+        default_row = admin_config["admin_password_is_default"]
     
     is_default = False
-    if config and verify_password("admin123", config.value):
+    if default_row and default_row.value == "1":
         if config_user and config_user.value == "admin":
             is_default = True
         
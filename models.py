@@ -20,3 +20,11 @@ class ConfigStorage(Base):
     id = Column(Integer, primary_key=True, index=True)
     key = Column(String, unique=True, index=True)
     value = Column(String)
+
+class GeoCache(Base):
+    __tablename__ = "geo_cache"
+    ip = Column(String, primary_key=True)
+    country = Column(String)
+    city = Column(String)
+    isp = Column(String)
+    fetched_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
@@ -18,6 +18,12 @@ def main():
                 db.add(config)
             else:
                 config.value = get_password_hash("admin123")
+            
+            default_flag = db.query(ConfigStorage).filter(ConfigStorage.key == "admin_password_is_default").first()
+            if not default_flag:
+                db.add(ConfigStorage(key="admin_password_is_default", value="1"))
+            else:
+                default_flag.value = "1"
             db.commit()
             print("====================================================")
             print("🚀 SUCCESS: Admin password has been reset to 'admin123'")
@@ -2,7 +2,9 @@ import os
 import shutil
 import stat
 import subprocess
-import json
+import tempfile
+import functools
+import orjson
 from pathlib import Path
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from fastapi.responses import FileResponse
@@ -21,19 +23,21 @@ class FileActionModel(BaseModel):
     dest: str = ""
 
 # ================= Docker API =================
+DOCKER_TIMEOUT_SECONDS = 10
+
 @router.get("/docker/containers")
 def list_docker_containers():
     """获取 Docker 容器列表 (检测并调用 docker cli)"""
     try:
         # Check if docker exists
-        res = subprocess.run(["docker", "ps", "-a", "--format", "{{json .}}"], capture_output=True, text=True)
+        # run() drains stdout and stderr together and kills docker if the daemon hangs
+        res = subprocess.run(["docker", "ps", "-a", "--format", "{{json .}}"],
+                             capture_output=True, timeout=DOCKER_TIMEOUT_SECONDS)
         if res.returncode != 0:
-            return {"installed": False, "containers": [], "error": res.stderr}
+            return {"installed": False, "containers": [], "error": res.stderr.decode(errors="replace")}
             
-        containers = []
-        for line in res.stdout.strip().split('\n'):
-            if line:
-                containers.append(json.loads(line))
+        # Bytes straight into orjson, no text decode of the whole output
+        containers = [orjson.loads(line) for line in res.stdout.splitlines() if line.strip()]
                 
         return {"installed": True, "containers": containers}
     except FileNotFoundError:
@@ -42,6 +46,9 @@ def list_docker_containers():
         return {"installed": False, "containers": [], "error": str(e)}
 
 # ================= File Manager API =================
+# Mode bits repeat heavily within a directory
+_filemode = functools.lru_cache(maxsize=512)(stat.filemode)
+
 @router.get("/fs/list")
 def list_directory(path: str = "/"):
     """浏览目标目录"""
@@ -50,23 +57,32 @@ def list_directory(path: str = "/"):
     if not os.path.isdir(path):
         raise HTTPException(status_code=400, detail="所选路径非目录")
         
-    items = []
+    # Directories and files are bucketed in one pass, so each bucket only sorts by name
+    dirs = []
+    files = []
     try:
         for entry in os.scandir(path):
-            stat_info = entry.stat()
-            items.append({
+            try:
+                stat_info = entry.stat()
+            except OSError:
+                # Broken symlink, describe the link itself
+                stat_info = entry.stat(follow_symlinks=False)
+            is_dir = entry.is_dir()
+            (dirs if is_dir else files).append({
                 "name": entry.name,
-                "is_dir": entry.is_dir(),
+                "is_dir": is_dir,
                 "size": stat_info.st_size,
                 "mtime": stat_info.st_mtime,
-                "permissions": stat.filemode(stat_info.st_mode),
+                "permissions": _filemode(stat_info.st_mode),
                 "absolute_path": entry.path
             })
     except PermissionError:
         raise HTTPException(status_code=403, detail="无权访问该目录")
         
     # Sort: Directories first, then alphabetically
-    items.sort(key=lambda x: (not x["is_dir"], x["name"].lower()))
+    dirs.sort(key=lambda x: x["name"].lower())
+    files.sort(key=lambda x: x["name"].lower())
+    items = dirs + files
     
     # Secure parent directory parsing
     parent = os.path.dirname(os.path.normpath(path))
@@ -79,6 +95,34 @@ def list_directory(path: str = "/"):
         "items": items
     }
 
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def _copy_upload(src, dst):
+    """Copy an uploaded file into dst, kernel-side when the spooled upload is already on disk"""
+    # Calling fileno() on an in-memory SpooledTemporaryFile would force it to disk,
+    # so small uploads still go through the buffered copy. The public API has no way
+    # to ask whether it has rolled over; _rolled is set by CPython's implementation.
+    in_memory = isinstance(src, tempfile.SpooledTemporaryFile) and not src._rolled
+    if hasattr(os, "copy_file_range") and not in_memory:
+        try:
+            src_fd = src.fileno()
+            dst_fd = dst.fileno()
+        except (AttributeError, OSError, ValueError):
+            pass
+        else:
+            start = offset = src.tell()
+            try:
+                while True:
+                    copied = os.copy_file_range(src_fd, dst_fd, 1 << 30, offset)
+                    if copied == 0:
+                        return
+                    offset += copied
+            except OSError:
+                # e.g. cross-filesystem copy on older kernels, continue in userspace
+                src.seek(offset)
+                dst.seek(offset - start)
+    shutil.copyfileobj(src, dst, length=COPY_CHUNK_SIZE)
+
 @router.post("/fs/upload")
 async def upload_file(path: str, file: UploadFile = File(...)):
     """向指定目录上传文件"""
@@ -88,7 +132,7 @@ async def upload_file(path: str, file: UploadFile = File(...)):
     dest_path = os.path.join(path, file.filename)
     try:
         with open(dest_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+            _copy_upload(file.file, buffer)
         return {"status": "success", "message": f"文件已上传至 {dest_path}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
@@ -4,13 +4,15 @@ import psutil
 import time
 import requests
 from collections import Counter
+from datetime import datetime, timedelta, timezone
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from database import get_db
-from models import ConfigStorage
+from models import ConfigStorage, GeoCache
 from auth import get_current_user
+from fileutils import tail
 
 router = APIRouter(
     prefix="/api/nginx",
@@ -21,9 +23,27 @@ router = APIRouter(
 class NginxConfigModel(BaseModel):
     log_path: str
 
+NGINX_PROCESS_NAMES = ('nginx', 'nginx.exe')
+
+# Last nginx process found, re-validated on each call instead of rescanning all processes
+_NGINX_CACHE = {"pid": None, "ctime": None}
+
 def get_nginx_process():
+    if _NGINX_CACHE["pid"]:
+        try:
+            p = psutil.Process(_NGINX_CACHE["pid"])
+            name = p.name()
+            # create_time guards against the PID having been reused by another process
+            if p.create_time() == _NGINX_CACHE["ctime"] and name in NGINX_PROCESS_NAMES:
+                return {"pid": p.pid, "name": name, "create_time": _NGINX_CACHE["ctime"]}
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            pass
+        _NGINX_CACHE["pid"] = _NGINX_CACHE["ctime"] = None
+        
     for p in psutil.process_iter(['pid', 'name', 'create_time']):
-        if p.info['name'] == 'nginx' or p.info['name'] == 'nginx.exe':
+        if p.info['name'] in NGINX_PROCESS_NAMES:
+            _NGINX_CACHE["pid"] = p.info['pid']
+            _NGINX_CACHE["ctime"] = p.info['create_time']
             return p.info
     return None
 
@@ -61,7 +81,21 @@ def save_nginx_config(config: NginxConfigModel, db: Session = Depends(get_db)):
 
 # Simple regex to extract IP from standard combined nginx log format
 # Example: 127.0.0.1 - - [10/Oct/2000:13:55:36 -0700] "GET /foo.html HTTP/1.0" 200 2326
-IP_REGEX = re.compile(r'^(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})')
+# Matched against raw bytes, so no per-line UTF-8 decode is needed.
+# MULTILINE lets a single findall() scan a whole block of lines.
+IP_REGEX = re.compile(rb'^(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', re.MULTILINE)
+
+# ip-api.com batch endpoint: up to 100 IPs per POST, 15 requests per minute
+GEO_API_URL = "http://ip-api.com/batch"
+GEO_BATCH_SIZE = 100
+GEO_CACHE_TTL = timedelta(days=7)
+
+# Reused across calls to keep the TCP connection to ip-api alive
+_geo_session = requests.Session()
+_geo_session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"})
+
+def _geo_info(row):
+    return {"country": row.country, "city": row.city, "isp": row.isp}
 
 @router.get("/analyze")
 def analyze_nginx_logs(lines: int = 5000, db: Session = Depends(get_db)):
@@ -73,56 +107,68 @@ def analyze_nginx_logs(lines: int = 5000, db: Session = Depends(get_db)):
         return {"error": f"Log file not found at {log_path}"}
         
     try:
-        # Read the last N lines efficiently
-        # Since standard python doesn't have a reliable tail without reading the whole file,
-        # we will chunk read from the end or just read all if the file isn't massive.
-        # For simplicity and robust parsing here, we'll read all lines but keep the last N.
-        # Ideally, we should use a reverse reader for huge files.
-        with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
-            # simple tail approximation
-            all_lines = f.readlines()
-            target_lines = all_lines[-lines:]
+        # Read the last N lines from the end of the file, memory stays O(lines)
+        target_lines = tail(log_path, lines)
             
-        ip_counter = Counter()
-        for line in target_lines:
-            match = IP_REGEX.search(line)
-            if match:
-                ip_counter[match.group(1)] += 1
+        # One findall over the whole tail instead of a regex call and counter update per line
+        ip_counter = Counter(IP_REGEX.findall(b'\n'.join(target_lines)))
                 
-        top_ips = ip_counter.most_common(50)
+        # Counter keys are bytes, only the top entries get decoded
+        top_ips = [(ip.decode('ascii'), count) for ip, count in ip_counter.most_common(50)]
         
         # Resolve GeoIP using free ip-api.com batch endpoint
-        # The batch API takes a POST request with an array of IPs, up to 100 at a time.
+        # Lookups are cached in the geo_cache table, only unknown or stale IPs hit the API.
         results = []
         if top_ips:
             ips_to_query = [ip[0] for ip in top_ips]
             
-            # Simple caching or batching: Note ip-api batch allows 15 requests per minute maximum.
+            fresh_after = datetime.now(timezone.utc) - GEO_CACHE_TTL
+            cached_rows = {row.ip: row for row in db.query(GeoCache).filter(GeoCache.ip.in_(ips_to_query)).all()}
+            geo_map = {
+                ip: _geo_info(row) for ip, row in cached_rows.items()
+                if row.fetched_at and row.fetched_at.replace(tzinfo=timezone.utc) >= fresh_after
+            }
+            missing = [ip for ip in ips_to_query if ip not in geo_map]
+            
+            error = None
             try:
-                # Need to be cautious of rate limits, but for manual panel trigger it's fine
-                headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
-                geo_res = requests.post("http://ip-api.com/batch", json=ips_to_query, headers=headers, timeout=10)
-                if geo_res.status_code == 200:
-                    geo_data = geo_res.json()
-                    # map IP to its geo info
-                    geo_map = {item['query']: item for item in geo_data if item['status'] == 'success'}
+                for i in range(0, len(missing), GEO_BATCH_SIZE):
+                    geo_res = _geo_session.post(GEO_API_URL, json=missing[i:i + GEO_BATCH_SIZE], timeout=10)
+                    if geo_res.status_code != 200:
+                        error = ("API Error", "")
+                        break
+                    now = datetime.now(timezone.utc)
+                    for item in geo_res.json():
+                        if item['status'] != 'success':
+                            continue
+                        row = cached_rows.get(item['query'])
+                        if not row:
+                            row = GeoCache(ip=item['query'])
+                            db.add(row)
+                        row.country = item.get("country", "Unknown")
+                        row.city = item.get("city", "Unknown")
+                        row.isp = item.get("isp", "")
+                        row.fetched_at = now
+                        geo_map[row.ip] = _geo_info(row)
+                    db.commit()
+            except Exception as e:
+                db.rollback()
+                error = ("Network Error", str(e)[:20])
                     
-                    for ip, count in top_ips:
-                        info = geo_map.get(ip, {})
-                        results.append({
-                            "ip": ip,
-                            "count": count,
-                            "country": info.get("country", "Unknown"),
-                            "city": info.get("city", "Unknown"),
-                            "isp": info.get("isp", "")
-                        })
-                else:
+            for ip, count in top_ips:
+                info = geo_map.get(ip)
+                if info is None and error:
                     # Fallback if API fails
-                    for ip, count in top_ips:
-                        results.append({"ip": ip, "count": count, "country": "API Error", "city": ""})
-            except Exception as e:
-                for ip, count in top_ips:
-                    results.append({"ip": ip, "count": count, "country": "Network Error", "city": str(e)[:20]})
+                    results.append({"ip": ip, "count": count, "country": error[0], "city": error[1]})
+                    continue
+                info = info or {}
+                results.append({
+                    "ip": ip,
+                    "count": count,
+                    "country": info.get("country", "Unknown"),
+                    "city": info.get("city", "Unknown"),
+                    "isp": info.get("isp", "")
+                })
         
         return {
             "total_analyzed_lines": len(target_lines),
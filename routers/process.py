@@ -1,8 +1,11 @@
 import os
+import re
+import heapq
 import psutil
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from auth import get_current_user
+from routers.network import get_cached_snapshot
 
 router = APIRouter(
     prefix="/api/process",
@@ -25,57 +28,51 @@ SERVICE_DICT = {
     "systemd": "系统核心守护进程"
 }
 
+# Lowercased lookup plus one prefix regex, longest keys first so "dockerd" wins over "docker"
+_SERVICES = {k.lower(): v for k, v in SERVICE_DICT.items()}
+_SERVICE_RE = re.compile(
+    r'^(' + '|'.join(re.escape(k) for k in sorted(_SERVICES, key=len, reverse=True)) + r')',
+    re.IGNORECASE
+)
+
 @router.get("/list")
 def list_processes():
     """获取运行中的进程列表，附加端口映射和中文注释。按内存消耗排序。"""
     
-    # 1. First map PID -> List of listening ports
-    pid_to_ports = {}
-    try:
-        # Require Admin/Root to see all.
-        connections = psutil.net_connections(kind='inet')
-        for c in connections:
-            if c.status == 'LISTEN' and c.pid:
-                if c.pid not in pid_to_ports:
-                    pid_to_ports[c.pid] = []
-                port = c.laddr.port
-                if port not in pid_to_ports[c.pid]:
-                    pid_to_ports[c.pid].append(port)
-    except psutil.AccessDenied:
-        pass # Handle gracefully if no root, though some might be missing
+    # 1. PID -> Set of listening ports, from the connection scan the scheduler already did
+    pid_to_ports = get_cached_snapshot()["pid_to_ports"]
 
     # 2. Collect Processes
-    processes = []
+    # Pick the top 100 by RSS straight from the iterator (O(N log 100)) so that output
+    # dicts are only built for the processes that are actually returned.
+    top = heapq.nlargest(
+        100,
+        psutil.process_iter(['pid', 'name', 'username', 'cpu_percent', 'memory_info']),
+        key=lambda p: p.info['memory_info'].rss if p.info['memory_info'] else 0
+    )
     
-    # Just iterate all processes
-    for p in psutil.process_iter(['pid', 'name', 'username', 'cpu_percent', 'memory_info']):
-        try:
-            info = p.info
-            name = info['name'] or ""
-            
-            # Simple match for service description
-            desc = ""
-            for key, val in SERVICE_DICT.items():
-                if name.lower().startswith(key.lower()):
-                    desc = val
-                    break
-                    
-            processes.append({
-                "pid": info['pid'],
-                "name": name,
-                "user": info['username'] or "Unknown",
-                "cpu_percent": info['cpu_percent'] or 0.0,
-                # Convert bytes to MB
-                "memory_mb": round((info['memory_info'].rss if info['memory_info'] else 0) / (1024 * 1024), 2),
-                "ports": pid_to_ports.get(info['pid'], []),
-                "description": desc
-            })
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
+    processes = []
+    for p in top:
+        info = p.info
+        name = info['name'] or ""
+        
+        # Simple prefix match for service description
+        m = _SERVICE_RE.match(name)
+        desc = _SERVICES[m.group(1).lower()] if m else ""
+                
+        processes.append({
+            "pid": info['pid'],
+            "name": name,
+            "user": info['username'] or "Unknown",
+            "cpu_percent": info['cpu_percent'] or 0.0,
+            # Convert bytes to MB
+            "memory_mb": round((info['memory_info'].rss if info['memory_info'] else 0) / (1024 * 1024), 2),
+            "ports": sorted(pid_to_ports.get(info['pid'], ())),
+            "description": desc
+        })
             
-    # Sort by memory usage descending and return top 100 to avoid freezing the front-end
-    processes.sort(key=lambda x: x['memory_mb'], reverse=True)
-    return processes[:100]
+    # Already sorted by memory usage descending, capped at 100 to avoid freezing the front-end
+    return processes
 
 @router.post("/kill/{pid}")
 def kill_process(pid: int):
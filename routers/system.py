@@ -1,16 +1,30 @@
 from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse, Response
+from sqlalchemy import Integer, cast, extract, func, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta, timezone
 import psutil
 import subprocess
 import os
 import re
-import json
+import orjson
+import math
+import time
+import asyncio
 from pydantic import BaseModel
 
+try:
+    # python3-systemd bindings, optional: without them we shell out to journalctl
+    from systemd import journal
+except ImportError:
+    journal = None
+
 from database import get_db
 from models import SystemMetricsHistory, ConfigStorage
 from auth import get_current_user
+import tasks
+from fileutils import tail
 
 router = APIRouter(
     prefix="/api/system",
@@ -21,7 +35,14 @@ router = APIRouter(
 class LayoutConfig(BaseModel):
     layout: dict
 
-@router.get("/metrics/history")
+# Upper bound on points returned by /metrics/history
+HISTORY_MAX_POINTS = 2000
+
+def _naive_utc(dt):
+    # SQLite hands back naive datetimes holding UTC
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+
+@router.get("/metrics/history", response_class=ORJSONResponse)
 def get_metrics_history(
     minutes: int = 60,
     start_time: str = None,
@@ -29,90 +50,119 @@ def get_metrics_history(
     db: Session = Depends(get_db)
 ):
     """获取历史监控数据（支持过去X分钟或特定时间段）"""
-    query = db.query(SystemMetricsHistory)
+    # The last hour is served from memory; the default view gets bytes encoded by the collector
+    if not (start_time and end_time) and 0 < minutes <= tasks.RECENT_WINDOW_MINUTES:
+        if minutes == tasks.RECENT_WINDOW_MINUTES:
+            return Response(content=tasks.get_recent_history_json(), media_type="application/json")
+        start = _naive_utc(datetime.now(timezone.utc)) - timedelta(minutes=minutes)
+        return ORJSONResponse(tasks.history_payload(tasks.get_recent_metrics(start)))
     
+    # Range bounds as naive UTC, which is what SQLite stores
+    now = _naive_utc(datetime.now(timezone.utc))
+    range_start = range_end = None
     if start_time and end_time:
         try:
             # Parse ISO 8601 strings from frontend
-            start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-            end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-            query = query.filter(
-                SystemMetricsHistory.timestamp >= start_dt,
-                SystemMetricsHistory.timestamp <= end_dt
-            )
+            range_start = _naive_utc(datetime.fromisoformat(start_time.replace('Z', '+00:00')))
+            range_end = _naive_utc(datetime.fromisoformat(end_time.replace('Z', '+00:00')))
         except ValueError:
-            pass
-    elif not (start_time and end_time):
-        time_threshold = datetime.now(timezone.utc) - timedelta(minutes=minutes)
-        query = query.filter(SystemMetricsHistory.timestamp >= time_threshold)
+            range_start = range_end = None
+    if range_start is None:
+        range_start = now - timedelta(minutes=minutes)
         
-    records = query.order_by(SystemMetricsHistory.timestamp.asc()).all()
-    
-    # Calculate network speed based on diffs (this is simplistic, per 3 seconds)
-    # ECharts needs arrays of arrays or parallel arrays
-    timestamps = []
-    cpu = []
-    mem_mb = []
-    net_sent_speed = [] # bytes per second
-    net_recv_speed = [] # bytes per second
-    
-    for i in range(len(records)):
-        r = records[i]
-        # Store timestamp string formats for ECharts usually like ISO
-        # Echarts handles ISO "2024-01-01T12:00:00Z" fine if formatted or timestamp
-        # Let's send local ISO time
-        # convert naive/utc to local (since frontend parses timezone)
+    ts_col = SystemMetricsHistory.timestamp
+    range_filter = [ts_col >= range_start]
+    if range_end is not None:
+        range_filter.append(ts_col <= range_end)
         
-        timestamps.append(r.timestamp.isoformat())
-        cpu.append(r.cpu_percent)
-        mem_mb.append(round(r.memory_used_mb, 2))
+    # A chart cannot show more than ~2000 points, so long ranges are averaged into
+    # time buckets by the DB instead of shipping every 3-second sample
+    span_seconds = ((range_end or now) - range_start).total_seconds()
+    bucket_seconds = math.ceil(span_seconds / HISTORY_MAX_POINTS)
+    
+    if bucket_seconds > tasks.COLLECT_INTERVAL_SECONDS:
+        # Floor division, a plain / renders as true division on SQLAlchemy 2.x
+        bucket = cast(extract('epoch', ts_col), Integer) // bucket_seconds
+        # Counters are cumulative, so the bucket's last value pairs with its last timestamp
+        stmt = select(
+            func.max(ts_col),
+            func.round(func.avg(SystemMetricsHistory.cpu_percent), 2),
+            func.round(func.avg(SystemMetricsHistory.memory_used_mb), 2),
+            func.max(SystemMetricsHistory.memory_total_mb),
+            func.max(SystemMetricsHistory.net_bytes_sent),
+            func.max(SystemMetricsHistory.net_bytes_recv)
+        ).where(*range_filter).group_by(bucket).order_by(bucket.desc())
+    else:
+        # Only the columns the charts need, as plain rows instead of ORM objects.
+        # The range filter is served by the index on timestamp.
+        stmt = select(
+            ts_col,
+            SystemMetricsHistory.cpu_percent,
+            # Rounded by the DB, rows written before the collector rounded are unrounded
+            func.round(SystemMetricsHistory.memory_used_mb, 2),
+            SystemMetricsHistory.memory_total_mb,
+            SystemMetricsHistory.net_bytes_sent,
+            SystemMetricsHistory.net_bytes_recv
+        ).where(*range_filter).order_by(ts_col.desc())
         
-        if i == 0:
-            net_sent_speed.append(0)
-            net_recv_speed.append(0)
-        else:
-            prev_r = records[i-1]
-            time_diff = (r.timestamp - prev_r.timestamp).total_seconds()
-            if time_diff > 0:
-                # Handle possible counter wrap-around (very rare but happens, psutil reset)
-                s_diff = max(0, r.net_bytes_sent - prev_r.net_bytes_sent)
-                r_diff = max(0, r.net_bytes_recv - prev_r.net_bytes_recv)
-                net_sent_speed.append(round(s_diff / time_diff, 2))
-                net_recv_speed.append(round(r_diff / time_diff, 2))
-            else:
-                net_sent_speed.append(0)
-                net_recv_speed.append(0)
-
-    return {
-        "timestamps": timestamps,
-        "cpu": cpu,
-        "memory_used_mb": mem_mb,
-        "net_sent_speed_bps": net_sent_speed,
-        "net_recv_speed_bps": net_recv_speed,
-        "memory_total_mb": records[0].memory_total_mb if records else 0,
-    }
+    # Newest first so the cap can only ever cut the oldest points. The newest samples
+    # are only flushed to the DB every few ticks, query_history adds them from the buffer.
+    records = tasks.query_history(db, stmt.limit(HISTORY_MAX_POINTS), range_start, range_end)
+    
+    # Returned as a response object so FastAPI skips jsonable_encoder
+    return ORJSONResponse(tasks.history_payload(records))
 
 @router.delete("/metrics/history")
 def clear_metrics_history(db: Session = Depends(get_db)):
     """清空所有历史监控数据"""
     try:
-        db.query(SystemMetricsHistory).delete()
-        db.commit()
-        return {"status": "success", "message": "已成功清空所有历史系统指标数据"}
+        # Clears the DB rows and the unflushed and in-memory samples in one step
+        tasks.clear_metrics_history(db)
     except Exception as e:
-        db.rollback()
         return {"status": "error", "message": str(e)}
+        
+    # Outside the buffer lock, compacting must not stall the collector
+    if db.bind.dialect.name == "sqlite":
+        try:
+            # Give the freed pages back to the filesystem; in WAL mode the
+            # main file only shrinks once the WAL is checkpointed.
+            # Best effort: it fails while the collector holds the DB, the data is cleared either way
+            db.execute(text("VACUUM"))
+            db.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        except Exception as e:
+            print(f"Error compacting database after clearing history: {e}")
+    return {"status": "success", "message": "已成功清空所有历史系统指标数据"}
+# Concurrent dashboard polls within the TTL share one psutil snapshot
+REALTIME_CACHE_TTL = 1.0
+_realtime_cache = {"ts": 0, "data": None}
+_realtime_lock = asyncio.Lock()
+
+# Fixed for the lifetime of the process, read once at import
+_CPU_LOGICAL = psutil.cpu_count(logical=True)
+_CPU_PHYSICAL = psutil.cpu_count(logical=False)
+_BOOT_TIME_ISO = datetime.fromtimestamp(psutil.boot_time()).isoformat()
+
 @router.get("/metrics/realtime")
-def get_realtime_metrics():
-    """获取实时概览（独立于调度器，直接读取psutil）"""
+async def get_realtime_metrics():
+    """获取实时概览（CPU 由后台每秒采样，其余直接读取psutil，1 秒内的请求共享同一份数据）"""
+    # Holding the lock while refilling means only one request reads /proc per TTL window;
+    # the reads themselves run in a worker thread so the event loop keeps serving others
+    async with _realtime_lock:
+        now = time.monotonic()
+        if _realtime_cache["data"] is None or now - _realtime_cache["ts"] >= REALTIME_CACHE_TTL:
+            _realtime_cache["data"] = await asyncio.to_thread(_collect_realtime_metrics)
+            _realtime_cache["ts"] = now
+        return _realtime_cache["data"]
+
+def _collect_realtime_metrics():
     mem = psutil.virtual_memory()
     disk = psutil.disk_usage('/')
     io_counters = psutil.disk_io_counters()
     
     return {
-        "cpu_percent": psutil.cpu_percent(interval=None),
-        "cpu_count_logical": psutil.cpu_count(logical=True),
-        "cpu_count_physical": psutil.cpu_count(logical=False),
+        "cpu_percent": tasks.CPU_PERCENT,
+        "cpu_count_logical": _CPU_LOGICAL,
+        "cpu_count_physical": _CPU_PHYSICAL,
         "memory": {
             "total_mb": round(mem.total / (1024*1024), 2),
             "used_mb": round(mem.used / (1024*1024), 2),
@@ -127,35 +177,91 @@ def get_realtime_metrics():
             "io_read_time": getattr(io_counters, 'read_time', 0) if io_counters else 0,
             "io_write_time": getattr(io_counters, 'write_time', 0) if io_counters else 0,
         },
-        "boot_time": datetime.fromtimestamp(psutil.boot_time()).isoformat()
+        "boot_time": _BOOT_TIME_ISO
     }
 
+# Cache-aside for the dashboard layout: loaded from the DB on first read and
+# replaced on save. The panel runs as a single process, so the copy cannot go stale.
+_layout_cache = {}
+
 @router.get("/config/layout")
 def get_layout_config(db: Session = Depends(get_db)):
-    config = db.query(ConfigStorage).filter(ConfigStorage.key == "dashboard_layout").first()
-    if config:
-        try:
-            return json.loads(config.value)
-        except:
-            return {}
-    return {}
+    # The session only checks out a connection once it runs a query, i.e. on a miss
+    if "layout" not in _layout_cache:
+        config = db.query(ConfigStorage).filter(ConfigStorage.key == "dashboard_layout").first()
+        layout = {}
+        if config:
+            try:
+                layout = orjson.loads(config.value)
+            except:
+                pass
+        _layout_cache["layout"] = layout
+    return _layout_cache["layout"]
 
 @router.post("/config/layout")
 def save_layout_config(layout_data: LayoutConfig, db: Session = Depends(get_db)):
-    config = db.query(ConfigStorage).filter(ConfigStorage.key == "dashboard_layout").first()
-    val = json.dumps(layout_data.layout)
-    if config:
-        config.value = val
-    else:
-        new_config = ConfigStorage(key="dashboard_layout", value=val)
-        db.add(new_config)
+    # ConfigStorage.value is a str column, orjson produces bytes
+    val = orjson.dumps(layout_data.layout).decode()
+    # Single INSERT ... ON CONFLICT(key) DO UPDATE instead of SELECT then UPDATE/INSERT
+    stmt = sqlite_insert(ConfigStorage).values(key="dashboard_layout", value=val)
+    db.execute(stmt.on_conflict_do_update(index_elements=[ConfigStorage.key], set_={"value": val}))
     db.commit()
+    _layout_cache["layout"] = layout_data.layout
     return {"message": "Layout saved successfully"}
 
+# Severity filter -> syslog priorities (0 emerg ... 7 debug)
+SEVERITY_PRIORITIES = {
+    "ERROR": range(0, 4),
+    "WARNING": range(4, 5),
+    "INFO": range(5, 7),
+}
+
+def _read_journal(severity: str, lines: int):
+    """Read the newest journal entries in-process, latest first"""
+    logs = []
+    reader = journal.Reader()
+    try:
+        # Matches on the same field are OR'ed together
+        for priority in SEVERITY_PRIORITIES.get(severity, ()):
+            reader.add_match(PRIORITY=str(priority))
+        reader.seek_tail()
+        while len(logs) < lines:
+            entry = reader.get_previous()
+            if not entry:
+                break
+            # The bindings already convert the timestamp to a datetime
+            ts = entry.get("__REALTIME_TIMESTAMP")
+            dt = ts.strftime("%Y-%m-%d %H:%M:%S") if ts else ""
+            msg = entry.get("MESSAGE", "")
+            syslog_id = entry.get("SYSLOG_IDENTIFIER", entry.get("_COMM", "kernel"))
+            logs.append({"time": dt, "source": syslog_id, "message": msg})
+    finally:
+        reader.close()
+    return logs
+
+SYSLOG_TAIL_LINES = 2000
+# e.g. "Jan  5 12:00:00 host sshd[123]: message"
+SYSLOG_LINE_RE = re.compile(rb'^([A-Z][a-z]{2}\s+\d+\s+\d{2}:\d{2}:\d{2})\s+\S+\s+([^:]+):\s+(.*)$')
+# Severity keyword filters for plain syslog lines: (pattern, keep the line if it matches)
+SYSLOG_SEVERITY_FILTERS = {
+    "ERROR": (re.compile(rb"err|fail|crit|fatal", re.IGNORECASE), True),
+    "WARNING": (re.compile(rb"warn", re.IGNORECASE), True),
+    "INFO": (re.compile(rb"err|fail|crit|fatal|warn", re.IGNORECASE), False),
+}
+
 @router.get("/logs")
 def get_system_logs(severity: str = "ALL", lines: int = 50):
     logs = []
-    # Attempt 1: journalctl (Standard on systemd)
+    # Attempt 1: journald through the python bindings, no process spawn or JSON round trip
+    if journal is not None:
+        try:
+            logs = _read_journal(severity, lines)
+            if logs:
+                return {"logs": logs, "source": "journald"}
+        except Exception:
+            logs = []
+            
+    # Attempt 2: journalctl (Standard on systemd)
     try:
         priority_arg = []
         if severity == "ERROR":
@@ -166,12 +272,13 @@ def get_system_logs(severity: str = "ALL", lines: int = 50):
             priority_arg = ["-p", "5..6"]
             
         cmd = ["journalctl", "--no-pager", "-n", str(lines), "-o", "json"] + priority_arg
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
+        # Kept as bytes, orjson parses the UTF-8 directly without a decode pass
+        result = subprocess.run(cmd, capture_output=True, timeout=5)
         
         if result.returncode == 0 and result.stdout.strip():
-            for line in result.stdout.strip().split('\n'):
+            for line in result.stdout.strip().split(b'\n'):
                 try:
-                    entry = json.loads(line)
+                    entry = orjson.loads(line)
                     ts = int(entry.get("__REALTIME_TIMESTAMP", 0)) / 1000000
                     dt = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else ""
                     msg = entry.get("MESSAGE", "")
@@ -184,31 +291,31 @@ def get_system_logs(severity: str = "ALL", lines: int = 50):
     except Exception:
         pass
         
-    # Attempt 2: Direct file read fallback
+    # Attempt 3: Direct file read fallback
     log_file = "/var/log/syslog" if os.path.exists("/var/log/syslog") else "/var/log/messages"
     if os.path.exists(log_file):
         try:
-            tail_cmd = ["tail", "-n", "2000", log_file]
-            res = subprocess.run(tail_cmd, capture_output=True, text=True, timeout=5)
-            if res.returncode == 0:
-                for line in reversed(res.stdout.strip().split('\n')):
-                    if len(logs) >= lines:
-                        break
-                    line_lower = line.lower()
-                    if severity == "ERROR" and not any(k in line_lower for k in ["err", "fail", "crit", "fatal"]):
-                        continue
-                    if severity == "WARNING" and "warn" not in line_lower:
-                        continue
-                    if severity == "INFO" and any(k in line_lower for k in ["err", "fail", "crit", "fatal", "warn"]):
+            # Last 2000 lines read backwards from EOF, so a large syslog is never
+            # scanned from the start; kept as bytes so filtering needs no decode
+            tail_lines = tail(log_file, SYSLOG_TAIL_LINES)
+            severity_filter = SYSLOG_SEVERITY_FILTERS.get(severity)
+            for line in reversed(tail_lines):
+                if len(logs) >= lines:
+                    break
+                if not line.strip():
+                    continue
+                if severity_filter:
+                    pattern, keep_matching = severity_filter
+                    if (pattern.search(line) is not None) != keep_matching:
                         continue
                         
-                    match = re.match(r'^([A-Z][a-z]{2}\s+\d+\s+\d{2}:\d{2}:\d{2})\s+\S+\s+([^:]+):\s+(.*)$', line)
-                    if match:
-                        date_str, source, msg = match.groups()
-                        logs.append({"time": date_str, "source": source, "message": msg})
-                    else:
-                        logs.append({"time": "", "source": "unknown", "message": line})
-                return {"logs": logs, "source": log_file}
+                match = SYSLOG_LINE_RE.match(line)
+                if match:
+                    date_str, source, msg = (g.decode("utf-8", errors="replace") for g in match.groups())
+                    logs.append({"time": date_str, "source": source, "message": msg})
+                else:
+                    logs.append({"time": "", "source": "unknown", "message": line.rstrip(b"\r\n").decode("utf-8", errors="replace")})
+            return {"logs": logs, "source": log_file}
         except:
             pass
             
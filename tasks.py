@@ -1,38 +1,305 @@
 import psutil
+import threading
+import time
+import operator
+import orjson
+from collections import Counter, defaultdict, deque
+from sqlalchemy import insert, delete, func, select, text
 from database import SessionLocal
 from models import SystemMetricsHistory
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+
+# Scheduler interval of collect_system_metrics
+COLLECT_INTERVAL_SECONDS = 3
+
+# Samples are written to the DB in batches: one commit per 10 ticks (30s) instead of per tick
+METRICS_FLUSH_EVERY = 10
+METRICS_RETENTION = timedelta(days=7)
+# Retention runs hourly, so each purge only removes about an hour of rows
+METRICS_PURGE_INTERVAL_HOURS = 1
+METRICS_PURGE_BATCH = 5000
+
+# Collected but not yet flushed rows. Timestamps are naive UTC, which is what SQLite stores.
+_metrics_buffer = []
+# Held for the whole flush and by query_history across its DB read and buffer read,
+# so a history read sees every sample exactly once, either in the DB or in the buffer
+_metrics_buffer_lock = threading.Lock()
+
+# The last hour of samples is also kept in memory together with its encoded
+# /api/system/metrics/history response, so the dashboard's default view never hits the DB
+RECENT_WINDOW_MINUTES = 60
+_recent_metrics = deque(maxlen=RECENT_WINDOW_MINUTES * 60 // COLLECT_INTERVAL_SECONDS)
+_recent_history_json = None
+_recent_lock = threading.Lock()
+
+# Latest system-wide CPU usage, refreshed every second by sample_cpu_percent.
+# psutil.cpu_percent(interval=None) measures since the previous call made from the
+# same thread, so it must only be called from that job's dedicated executor.
+CPU_PERCENT = 0.0
+
+def sample_cpu_percent():
+    global CPU_PERCENT
+    CPU_PERCENT = psutil.cpu_percent(interval=None)
 
 def collect_system_metrics():
+    try:
+        # CPU
+        cpu_percent = CPU_PERCENT
+        
+        # Memory
+        mem = psutil.virtual_memory()
+        # Rounded once here instead of per point on every history request
+        memory_used_mb = round(mem.used / (1024 * 1024), 2)
+        memory_total_mb = round(mem.total / (1024 * 1024), 2)
+        
+        # Network (Total across all interfaces)
+        net_io = psutil.net_io_counters()
+        
+        row = {
+            "timestamp": datetime.now(timezone.utc).replace(tzinfo=None),
+            "cpu_percent": cpu_percent,
+            "memory_used_mb": memory_used_mb,
+            "memory_total_mb": memory_total_mb,
+            "net_bytes_sent": net_io.bytes_sent,
+            "net_bytes_recv": net_io.bytes_recv
+        }
+        
+        # Both stores are updated under the buffer lock, so clear_metrics_history
+        # never sees a sample in one of them but not the other
+        with _metrics_buffer_lock:
+            with _recent_lock:
+                _recent_metrics.append(tuple(row.values()))
+                _refresh_recent_locked()
+            _metrics_buffer.append(row)
+            if len(_metrics_buffer) >= METRICS_FLUSH_EVERY:
+                _flush_metrics_locked()
+    except Exception as e:
+        print(f"Error collecting metrics: {e}")
+            
+    collect_network_connections()
+
+def _flush_metrics_locked():
     # Use context manager to ensure DB session is closed
     with SessionLocal() as db:
         try:
-            # CPU
-            cpu_percent = psutil.cpu_percent(interval=None) # Non-blocking in background
-            
-            # Memory
-            mem = psutil.virtual_memory()
-            memory_used_mb = mem.used / (1024 * 1024)
-            memory_total_mb = mem.total / (1024 * 1024)
-            
-            # Network (Total across all interfaces)
-            net_io = psutil.net_io_counters()
-            
-            new_record = SystemMetricsHistory(
-                timestamp=datetime.now(timezone.utc),
-                cpu_percent=cpu_percent,
-                memory_used_mb=memory_used_mb,
-                memory_total_mb=memory_total_mb,
-                net_bytes_sent=net_io.bytes_sent,
-                net_bytes_recv=net_io.bytes_recv
-            )
-            
-            db.add(new_record)
-            
-            # Optional: Housekeeping, delete records older than X days to keep DB small
-            # (Can implement later if needed, for now just append)
-            
+            # Core bulk insert, a single executemany and commit for the whole batch
+            db.execute(insert(SystemMetricsHistory), _metrics_buffer)
+            db.commit()
+        except Exception as e:
+            print(f"Error saving metrics: {e}")
+            db.rollback()
+    _metrics_buffer.clear()
+
+def flush_metrics_buffer():
+    """Write any buffered samples to the DB, called on shutdown"""
+    with _metrics_buffer_lock:
+        if _metrics_buffer:
+            _flush_metrics_locked()
+
+def clear_metrics_history(db):
+    """Delete all stored history together with the buffered and in-memory samples"""
+    # Under the buffer lock a flush cannot write pre-clear samples back after the delete
+    with _metrics_buffer_lock:
+        try:
+            table = SystemMetricsHistory.__tablename__
+            if db.bind.dialect.name == "postgresql":
+                db.execute(text(f"TRUNCATE {table}"))
+            else:
+                # Unqualified DELETE hits SQLite's truncate optimization, no per-row work
+                db.execute(text(f"DELETE FROM {table}"))
             db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        _metrics_buffer.clear()
+        with _recent_lock:
+            _recent_metrics.clear()
+            _refresh_recent_locked()
+
+def query_history(db, stmt, start=None, end=None):
+    """Run a newest-first history select and append the buffered samples within
+    [start, end] (naive UTC). Returns history rows, oldest first:
+    (timestamp, cpu_percent, memory_used_mb, memory_total_mb, net_bytes_sent, net_bytes_recv)"""
+    # A flush between the select and the buffer read would drop its rows from both
+    with _metrics_buffer_lock:
+        # Core connection: rows come back as plain tuples without ORM result loading
+        records = db.connection().execute(stmt).all()
+        records.reverse()
+        records.extend(
+            (r["timestamp"], r["cpu_percent"], r["memory_used_mb"], r["memory_total_mb"],
+             r["net_bytes_sent"], r["net_bytes_recv"])
+            for r in _metrics_buffer
+            if (start is None or r["timestamp"] >= start) and (end is None or r["timestamp"] <= end)
+        )
+    return records
+
+def _rate_series(counters, time_diffs):
+    """Per-second rates of a cumulative counter column, the first point is always 0"""
+    rates = [0]
+    # Negative diffs mean the counter was reset (psutil/boot), report 0 for those.
+    # Left unrounded, the charts format bytes/s for display themselves
+    rates.extend(
+        max(0, diff) / dt if dt > 0 else 0
+        for diff, dt in zip(map(operator.sub, counters[1:], counters), time_diffs)
+    )
+    return rates
+
+def history_payload(records):
+    """Body of /api/system/metrics/history for chronologically ordered history rows"""
+    if not records:
+        return {
+            "timestamps": [],
+            "cpu": [],
+            "memory_used_mb": [],
+            "net_sent_speed_bps": [],
+            "net_recv_speed_bps": [],
+            "memory_total_mb": 0,
+        }
+    
+    # ECharts needs parallel arrays, so transpose the rows into columns once
+    # and work on whole columns instead of indexing records one by one
+    ts, cpu, mem_mb, mem_total, sent, recv = zip(*records)
+    
+    # Calculate network speed based on diffs between consecutive samples (per 3 seconds)
+    time_diffs = [d.total_seconds() for d in map(operator.sub, ts[1:], ts)]
+    
+    # orjson writes the datetimes as ISO 8601 itself, no per-row isoformat() needed
+    return {
+        "timestamps": ts,
+        "cpu": cpu,
+        "memory_used_mb": mem_mb,
+        "net_sent_speed_bps": _rate_series(sent, time_diffs),
+        "net_recv_speed_bps": _rate_series(recv, time_diffs),
+        "memory_total_mb": mem_total[0],
+    }
+
+def _recent_since_locked(start):
+    # Rows are appended in time order, so the window is a suffix of the deque
+    return [r for r in _recent_metrics if r[0] >= start]
+
+def _refresh_recent_locked():
+    global _recent_history_json
+    start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=RECENT_WINDOW_MINUTES)
+    _recent_history_json = orjson.dumps(history_payload(_recent_since_locked(start)))
+
+def load_recent_metrics():
+    """Fill the in-memory window from the DB, called once on startup"""
+    start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=RECENT_WINDOW_MINUTES)
+    with SessionLocal() as db:
+        rows = db.execute(select(
+            SystemMetricsHistory.timestamp,
+            SystemMetricsHistory.cpu_percent,
+            func.round(SystemMetricsHistory.memory_used_mb, 2),
+            SystemMetricsHistory.memory_total_mb,
+            SystemMetricsHistory.net_bytes_sent,
+            SystemMetricsHistory.net_bytes_recv
+        ).where(SystemMetricsHistory.timestamp >= start).order_by(SystemMetricsHistory.timestamp)).all()
+    with _recent_lock:
+        _recent_metrics.clear()
+        _recent_metrics.extend(tuple(r) for r in rows)
+        _refresh_recent_locked()
+
+def get_recent_history_json():
+    """Pre-encoded history response for the last RECENT_WINDOW_MINUTES, rebuilt every tick"""
+    with _recent_lock:
+        if _recent_history_json is None:
+            _refresh_recent_locked()
+        return _recent_history_json
+
+def get_recent_metrics(start):
+    """In-memory history rows since start (naive UTC), start must lie within the recent window"""
+    with _recent_lock:
+        return _recent_since_locked(start)
+
+def purge_old_metrics():
+    """Housekeeping: delete history older than METRICS_RETENTION to keep the DB small"""
+    cutoff = datetime.now(timezone.utc) - METRICS_RETENTION
+    with SessionLocal() as db:
+        try:
+            while True:
+                # Bounded batches keep each write transaction and the WAL short,
+                # so a large backlog never blocks the collector for long
+                expired_ids = select(SystemMetricsHistory.id).where(
+                    SystemMetricsHistory.timestamp < cutoff
+                ).limit(METRICS_PURGE_BATCH).scalar_subquery()
+                result = db.execute(delete(SystemMetricsHistory).where(SystemMetricsHistory.id.in_(expired_ids)))
+                db.commit()
+                if result.rowcount < METRICS_PURGE_BATCH:
+                    break
         except Exception as e:
-            print(f"Error collecting metrics: {e}")
+            print(f"Error purging old metrics: {e}")
             db.rollback()
+
+# Latest connection statistics, served by /api/network/connections.
+# Written only by the scheduler thread, read by request threads under the lock.
+NETWORK_SNAPSHOT = {
+    "status_counts": {},
+    "total_connections": 0,
+    "rate": {"new_per_3s": 0, "closed_per_3s": 0},
+    "pid_to_ports": {},
+}
+NETWORK_SNAPSHOT_LOCK = threading.Lock()
+
+ACTIVE_CONN_STATES = frozenset(['ESTABLISHED', 'TIME_WAIT', 'CLOSE_WAIT', 'SYN_SENT', 'SYN_RECV'])
+
+# Previous connection signatures, used for calculating diffs
+_last_connections_snapshot = frozenset()
+_last_snapshot_time = 0
+
+def collect_network_connections():
+    """Scan /proc/net once per tick and publish connection counts and 3-second rates"""
+    global _last_connections_snapshot, _last_snapshot_time
+    
+    connections = []
+    try:
+        # Accessing all connections requires root/Admin on some OS.
+        # using 'inet' gets all tcp and udp
+        connections = psutil.net_connections(kind='inet')
+    except psutil.AccessDenied:
+        # On windows without admin, we might only get our own process connections
+        pass
+    except Exception as e:
+        print(f"Error collecting connections: {e}")
+        return
+
+    # Current snapshot signatures: (laddr, raddr). psutil already hands these out as
+    # hashable namedtuples (or an empty tuple when unset), so the signature just
+    # pairs existing objects without branching on missing addresses.
+    current_snapshot = frozenset(
+        (c.laddr, c.raddr) for c in connections if c.status in ACTIVE_CONN_STATES
+    )
+    status_counts = dict(Counter(c.status for c in connections))
+    
+    # PID -> Set of listening ports, consumed by the process list
+    pid_to_ports = defaultdict(set)
+    for c in connections:
+        if c.status == 'LISTEN' and c.pid:
+            pid_to_ports[c.pid].add(c.laddr.port)
+
+    # Calculate diff
+    current_time = time.time()
+    time_diff = current_time - _last_snapshot_time
+    
+    # Only calculate meaningful diff if within a reasonable refresh window (e.g., 2-5 seconds).
+    new_conns = 0
+    closed_conns = 0
+    
+    if 1 < time_diff < 10 and _last_connections_snapshot:
+        new_conns = len(current_snapshot - _last_connections_snapshot)
+        closed_conns = len(_last_connections_snapshot - current_snapshot)
+        # Normalize to per 3 seconds if scheduler timing varies slightly
+        rate_multiplier = 3.0 / time_diff
+        new_conns = int(new_conns * rate_multiplier)
+        closed_conns = int(closed_conns * rate_multiplier)
+
+    _last_connections_snapshot = current_snapshot
+    _last_snapshot_time = current_time
+    
+    with NETWORK_SNAPSHOT_LOCK:
+        NETWORK_SNAPSHOT["status_counts"] = status_counts
+        NETWORK_SNAPSHOT["total_connections"] = len(connections)
+        NETWORK_SNAPSHOT["rate"] = {
+            "new_per_3s": new_conns,
+            "closed_per_3s": closed_conns
+        }
+        NETWORK_SNAPSHOT["pid_to_ports"] = pid_to_ports